@@ -1,14 +1,194 @@
-import os
 import time
-from datetime import datetime
-import shutil
+import asyncio
+import contextlib
+import functools
+import sqlite3
+import threading
+from collections import OrderedDict
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
 import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Digit runs long enough to hold an integer that orjson cannot represent exactly (above 64 bits)
+_LONG_DIGITS = re.compile(rb'\d{20}')
+
+
+def _dumps(value) -> bytes:
+    """
+    Serializes a value to compact JSON bytes, using orjson when it produces the same output as json.
+
+    :param value: The value to serialize.
+    :return: The JSON encoded value.
+    """
+    if orjson is not None:
+        try:
+            data = orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # orjson rejects some values json accepts, e.g. integers above 64 bits
+            data = None
+        # orjson writes NaN and Infinity as null, let json write them as it always did
+        if data is not None and b'null' not in data:
+            return data
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _loads(data: bytes):
+    """
+    Deserializes JSON bytes, using orjson when it decodes them exactly like json.
+
+    :param data: The JSON encoded value.
+    :return: The decoded value.
+    """
+    if orjson is not None and not _LONG_DIGITS.search(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson rejects the NaN and Infinity literals json writes
+            pass
+    return json.loads(data)
+
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import aioboto3
+except ImportError:
+    aioboto3 = None
+
+
+_DAY_SECONDS = 86400
+
+# Number of worker threads used to fan out per-object S3 requests
+_MAX_WORKERS = 32
+
+# Size of the HTTP connection pool, kept >= _MAX_WORKERS so workers never wait for a connection
+_MAX_POOL_CONNECTIONS = 64
+
+# Maximum number of in-flight requests of the async methods
+_MAX_ASYNC_CONCURRENCY = 64
+
+# SQLite database holding the values spilled from the in-memory cache
+_CACHE_DB_PATH = '/tmp/s3kv_cache.sqlite'
+
+# Default bounds of the in-memory LRU cache
+_CACHE_MAX_ENTRIES = 1024
+_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Bounds of the negative cache remembering keys recently found missing
+_NEGATIVE_CACHE_MAX_ENTRIES = 1024
+_NEGATIVE_CACHE_TTL = 10  # seconds
+
+# Number of cache reads between two sweeps of the on-disk cache
+_CACHE_SWEEP_INTERVAL = 1000
+
+# Maximum number of keys accepted by a single delete_objects request
+_DELETE_BATCH_SIZE = 1000
+
+# Extracts the S3 object key from an object summary
+_get_key = itemgetter('Key')
+
+
+def _client_config(max_pool_connections: int) -> Config:
+    """
+    Builds the botocore configuration shared by the S3 clients.
+
+    :param max_pool_connections: The size of the HTTP connection pool.
+    :return: The botocore configuration.
+    """
+    return Config(
+        max_pool_connections=max_pool_connections,
+        retries={'max_attempts': 10, 'mode': 'adaptive'},
+        tcp_keepalive=True
+    )
+
+
+@functools.lru_cache(maxsize=8)
+def _make_client(endpoint_url: str, aws_access_key_id: str, aws_secret_access_key: str,
+                 max_pool_connections: int = _MAX_POOL_CONNECTIONS):
+    """
+    Creates an S3 client, reusing the client (and its connection pool) of previous calls with the same arguments.
+    boto3 clients are thread safe, so the returned client can be shared across S3KV instances.
+
+    :param endpoint_url: The s3 endpoint.
+    :param aws_access_key_id: AWS access key ID.
+    :param aws_secret_access_key: AWS secret access key.
+    :param max_pool_connections: (Optional) The size of the HTTP connection pool.
+    :return: The S3 client.
+    """
+    return boto3.client(
+        's3',
+        endpoint_url=endpoint_url,
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        config=_client_config(max_pool_connections)
+    )
+
+
+# Thread pool shared by all S3KV instances, its threads are only started when work is submitted
+_executor = ThreadPoolExecutor(max_workers=_MAX_WORKERS)
+
+# Negative cache of (bucket, key) -> time at which the key was found missing in S3, shared by all
+# S3KV instances so that a write through one instance is seen by the others
+_negative_cache = OrderedDict()
+_negative_cache_lock = threading.Lock()
+
+# SQLite connection shared by all S3KV instances, opened on first use
+_cache_db = None
+_cache_db_lock = threading.Lock()
+
+
+def _get_cache_db() -> sqlite3.Connection:
+    """
+    Opens the SQLite cache database on first use and returns the shared connection.
+    Queries on the connection must hold _cache_db_lock.
+
+    :return: The SQLite connection.
+    """
+    global _cache_db
+    with _cache_db_lock:
+        if _cache_db is None:
+            db = sqlite3.connect(_CACHE_DB_PATH, check_same_thread=False, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB, ts REAL)')
+            _cache_db = db
+        return _cache_db
+
+
+@contextlib.contextmanager
+def _transaction(db: sqlite3.Connection):
+    """
+    Runs the enclosed statements in a single transaction on a connection opened in autocommit mode.
+    The caller must hold _cache_db_lock.
+
+    :param db: The SQLite connection.
+    """
+    db.execute('BEGIN')
+    try:
+        yield db
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    db.execute('COMMIT')
 
 
 class S3KV:
     def __init__(self, s3_endpoint_url:str, bucket_name: str, 
-                 aws_access_key_id: str = None, aws_secret_access_key: str = None , enable_local_cache=True):
+                 aws_access_key_id: str = None, aws_secret_access_key: str = None , enable_local_cache=True,
+                 cache_max_entries: int = _CACHE_MAX_ENTRIES, cache_max_bytes: int = _CACHE_MAX_BYTES):
         """
         Initializes the S3KV object with the given S3 bucket, AWS credentials, and Elasticsearch host.
 
@@ -16,19 +196,35 @@ class S3KV:
         :param bucket_name: The name of the S3 bucket to use for storing the key-value data.
         :param aws_access_key_id: (Optional) AWS access key ID.
         :param aws_secret_access_key: (Optional) AWS secret access key.
+        :param cache_max_entries: (Optional) The maximum number of values kept in the in-memory cache.
+        :param cache_max_bytes: (Optional) The maximum serialized size of the values kept in the in-memory cache.
         """
         self.bucket_name = bucket_name
         self.enable_local_cache = enable_local_cache
-        self.s3_client = boto3.client(
-            's3',
+        self._prefix = 's3kv/'
+        self._suffix = '.json'
+        self.s3_client = _make_client(s3_endpoint_url, aws_access_key_id, aws_secret_access_key)
+
+        # Kept to create aioboto3 clients for the async methods
+        self._client_kwargs = dict(
             endpoint_url=s3_endpoint_url,
             aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key
+            aws_secret_access_key=aws_secret_access_key,
+            config=_client_config(_MAX_POOL_CONNECTIONS)
         )
+        self._executor = _executor
 
+        # In-memory LRU cache of key -> (raw JSON value, cached_at), spilled to the SQLite cache on eviction
+        self._lru = OrderedDict()
+        self._lru_bytes = 0
+        self._lru_lock = threading.Lock()
+        self.cache_max_entries = cache_max_entries
+        self.cache_max_bytes = cache_max_bytes
+        self._cache_reads = 0
 
-        if not os.path.exists('/tmp/s3kv_cache'):
-            os.makedirs('/tmp/s3kv_cache')
+        # On-disk cache of key -> (raw JSON value, cached_at), shared by all instances
+        self._db = _get_cache_db()
+        self._db_lock = _cache_db_lock
 
     def _get_object_key(self, key: str) -> str:
         """
@@ -37,33 +233,210 @@ class S3KV:
         :param key: The key used to access the value in the S3 bucket.
         :return: The S3 object key for the given key.
         """
-        return f"s3kv/{key}.json"
+        return self._prefix + key + self._suffix
+
+    def _cache_put(self, key: str, data: bytes, cached_at: float = None):
+        """
+        Stores a serialized value in the in-memory LRU cache, spilling the least recently used entries to disk.
+        Values are cached as JSON bytes so later changes to the caller's objects do not leak into the cache.
+
+        :param key: The key of the value to cache.
+        :param data: The JSON encoded value to cache.
+        :param cached_at: (Optional) The timestamp at which the value was cached, defaults to now.
+        """
+        with self._lru_lock:
+            self._cache_put_locked(key, data, cached_at, True)
+
+    def _cache_put_locked(self, key: str, data: bytes, cached_at: float, drop_row: bool):
+        """
+        Stores a serialized value in the in-memory LRU cache. The caller must hold _lru_lock, so that spilled
+        entries reach the disk before any other cache operation can run.
+
+        :param key: The key of the value to cache.
+        :param data: The JSON encoded value to cache.
+        :param cached_at: The timestamp at which the value was cached, None for now.
+        :param drop_row: Whether to remove the on-disk row of the key, which is stale when the value is new.
+        """
+        if cached_at is None:
+            cached_at = time.time()
+
+        evicted = []
+        if key in self._lru:
+            self._lru_bytes -= len(self._lru.pop(key)[0])
+        self._lru[key] = (data, cached_at)
+        self._lru_bytes += len(data)
+        while len(self._lru) > 1 and (len(self._lru) > self.cache_max_entries
+                                      or self._lru_bytes > self.cache_max_bytes):
+            evicted_key, (evicted_data, evicted_at) = self._lru.popitem(last=False)
+            self._lru_bytes -= len(evicted_data)
+            evicted.append((evicted_key, evicted_data, evicted_at))
+
+        if drop_row or evicted:
+            with self._db_lock, _transaction(self._db):
+                if drop_row:
+                    self._db.execute('DELETE FROM kv WHERE key = ?', (key,))
+                self._db.executemany('INSERT OR REPLACE INTO kv (key, value, ts) VALUES (?, ?, ?)', evicted)
+
+    def _cache_pop(self, key: str):
+        """
+        Removes a key from the in-memory LRU cache and from the on-disk cache.
+
+        :param key: The key to remove from the cache.
+        """
+        with self._lru_lock:
+            if key in self._lru:
+                self._lru_bytes -= len(self._lru.pop(key)[0])
+            with self._db_lock:
+                self._db.execute('DELETE FROM kv WHERE key = ?', (key,))
+
+    def _cached_at(self, key: str) -> float:
+        """
+        Gets the time at which a key was stored in the local cache.
+
+        :param key: The key to look up in the cache.
+        :return: The timestamp at which the key was cached, or 0 if it is not cached.
+        """
+        with self._lru_lock:
+            entry = self._lru.get(key)
+        if entry is not None:
+            return entry[1]
+
+        with self._db_lock:
+            row = self._db.execute('SELECT ts FROM kv WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _is_known_missing(self, key: str) -> bool:
+        """
+        Checks whether a key was recently found missing in S3.
+
+        :param key: The key to check.
+        :return: True if the key was found missing less than _NEGATIVE_CACHE_TTL seconds ago, False otherwise.
+        """
+        with _negative_cache_lock:
+            missing_at = _negative_cache.get((self.bucket_name, key))
+            if missing_at is None:
+                return False
+            if time.monotonic() - missing_at < _NEGATIVE_CACHE_TTL:
+                return True
+            del _negative_cache[(self.bucket_name, key)]
+            return False
+
+    def _remember_missing(self, key: str):
+        """
+        Records that a key was found missing in S3.
+
+        :param key: The missing key.
+        """
+        with _negative_cache_lock:
+            _negative_cache.pop((self.bucket_name, key), None)
+            _negative_cache[(self.bucket_name, key)] = time.monotonic()
+            if len(_negative_cache) > _NEGATIVE_CACHE_MAX_ENTRIES:
+                _negative_cache.popitem(last=False)
+
+    def _forget_missing(self, key: str):
+        """
+        Removes a key from the negative cache after it has been written or deleted.
+
+        :param key: The key to forget.
+        """
+        with _negative_cache_lock:
+            _negative_cache.pop((self.bucket_name, key), None)
+
+    def _stale_keys(self, contents: list) -> list:
+        """
+        Selects the keys of a listing page whose cached value is missing or older than the stored one.
+
+        :param contents: The object summaries of a list_objects_v2 page.
+        :return: The keys that need to be fetched.
+        """
+        pl, sl = len(self._prefix), len(self._suffix)
+        keys = []
+        for obj in contents:
+            if not obj['Key'].endswith(self._suffix):
+                continue
+            key = obj['Key'][pl:-sl]
+            if self._cached_at(key) < obj['LastModified'].timestamp():
+                keys.append(key)
+        return keys
 
     def cache_all_keys(self):
         """
-        Saves all keys to the local /tmp directory as they are being added.
+        Saves all keys to the local cache, skipping keys whose cached value is newer than the stored one.
+        """
+        for contents in self._iter_pages(self._prefix):
+            # Fetch one page at a time so at most a page of values is held in memory
+            futures = {self._executor.submit(self._get_raw, key): key for key in self._stale_keys(contents)}
+
+            for future in as_completed(futures):
+                key = futures.pop(future)
+                data = future.result()
+                if data is not None:
+                    self._cache_put(key, data)
+
+    def _async_client(self):
+        """
+        Creates an aioboto3 S3 client configured like the synchronous client.
+
+        :return: An async context manager yielding the client.
+        """
+        if aioboto3 is None:
+            raise ImportError("The async methods require the aioboto3 package")
+        return aioboto3.Session().client('s3', **self._client_kwargs)
+
+    async def cache_all_keys_async(self):
+        """
+        Saves all keys to the local cache using asyncio, skipping keys whose cached value is newer than the
+        stored one. Requires the aioboto3 package.
         """
-        keys = self.list_keys()
-        for key in keys:
-            value = self.get(key)
-            if value is not None:
-                with open(f'/tmp/s3kv_cache/{key}.json', 'w') as f:
-                    json.dump(value, f)
+        semaphore = asyncio.Semaphore(_MAX_ASYNC_CONCURRENCY)
+        loop = asyncio.get_running_loop()
+
+        async with self._async_client() as client:
+            async def fetch(key: str):
+                async with semaphore:
+                    try:
+                        response = await client.get_object(Bucket=self.bucket_name, Key=self._get_object_key(key))
+                        data = await response['Body'].read()
+                    except ClientError as e:
+                        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                            return
+                        raise
+                # The cache may block on SQLite, keep it off the event loop
+                await loop.run_in_executor(self._executor, self._cache_put, key, data)
+
+            paginator = client.get_paginator('list_objects_v2')
+            async for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self._prefix,
+                                                 PaginationConfig={'PageSize': 1000}):
+                # Fetch one page at a time so at most a page of values is held in memory
+                keys = await loop.run_in_executor(self._executor, self._stale_keys, page.get('Contents', []))
+                await asyncio.gather(*(fetch(key) for key in keys))
 
     def get_from_cache(self, key: str) -> dict:
         """
-        Retrieves a key from the local cache if present, and clears old cache entries.
+        Retrieves a key from the local cache if present. Old on-disk cache entries are cleared periodically.
+        The in-memory cache belongs to this instance, other instances only share the on-disk cache.
 
         :param key: The key to retrieve from the cache.
         :return: The value associated with the given key if present in the cache, else None.
         """
-        self.clear_old_cache()
-        cache_path = f'/tmp/s3kv_cache/{key}.json'
-        if os.path.exists(cache_path):
-            with open(cache_path, 'r') as f:
-                return json.load(f)
-        else:
-            return None
+        with self._lru_lock:
+            self._cache_reads += 1
+            sweep = self._cache_reads % _CACHE_SWEEP_INTERVAL == 0
+            entry = self._lru.get(key)
+            if entry is not None:
+                self._lru.move_to_end(key)
+                data = entry[0]
+            else:
+                # Fall back to entries spilled to disk. The row is kept, other instances and processes share it
+                with self._db_lock:
+                    row = self._db.execute('SELECT value, ts FROM kv WHERE key = ?', (key,)).fetchone()
+                data = row[0] if row else None
+                if row:
+                    self._cache_put_locked(key, row[0], row[1], False)
+        if sweep:
+            self.clear_old_cache()
+
+        return _loads(data) if data is not None else None
 
 
     def add(self, key: str, value: dict, metadata: dict = None):
@@ -75,11 +448,11 @@ class S3KV:
         :param metadata: (Optional) Metadata associated with the data (will be sent to Elasticsearch).
         """
         s3_object_key = self._get_object_key(key)
-        serialized_value = json.dumps(value)
+        serialized_value = _dumps(value)
         self.s3_client.put_object(Bucket=self.bucket_name, Key=s3_object_key, Body=serialized_value)
 
-        with open(f'/tmp/s3kv_cache/{key}.json', 'w') as f:
-            json.dump(value, f)
+        self._forget_missing(key)
+        self._cache_put(key, serialized_value)
 
 
 
@@ -92,9 +465,8 @@ class S3KV:
         s3_object_key = self._get_object_key(key)
         self.s3_client.delete_object(Bucket=self.bucket_name, Key=s3_object_key)
 
-        cache_path = f'/tmp/s3kv_cache/{key}.json'
-        if os.path.exists(cache_path):
-            os.remove(cache_path)
+        self._forget_missing(key)
+        self._cache_pop(key)
 
 
     def get(self, key: str, default: dict = None) -> dict:
@@ -105,34 +477,129 @@ class S3KV:
         :param default: (Optional) The default value to return if the key does not exist.
         :return: The value associated with the given key, or the default value if the key does not exist.
         """
+        value = self._get_raw(key)
+        if value is None:
+            return default
+        return _loads(value)
+
+
+    def _get_raw(self, key: str) -> bytes:
+        """
+        Retrieves the JSON encoded value associated with the given key from the S3KV database.
+
+        :param key: The key whose value is to be retrieved.
+        :return: The raw value associated with the given key, or None if the key does not exist.
+        """
+        # Avoid a round-trip for keys that were just found missing
+        if self._is_known_missing(key):
+            return None
+
         s3_object_key = self._get_object_key(key)
         try:
             response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_object_key)
-            value = response['Body'].read()
-            return json.loads(value)
+            return response['Body'].read()
         except self.s3_client.exceptions.NoSuchKey:
-            return default
+            self._remember_missing(key)
+            return None
 
 
-    def list_keys(self) -> list:
+    def get_stream(self, key: str, prefix: str = ''):
+        """
+        Incrementally parses the value associated with the given key without loading it fully in memory.
+        Requires the ijson package.
+
+        :param key: The key whose value is to be retrieved.
+        :param prefix: (Optional) The ijson prefix of the items to yield, e.g. 'item' for the elements
+                       of a top-level list. Defaults to the whole value.
+        :return: An iterator of the items found under the prefix, empty if the key does not exist.
+                 Call its close() method when stopping early to release the connection right away.
+        """
+        if ijson is None:
+            raise ImportError("get_stream requires the ijson package")
+
+        s3_object_key = self._get_object_key(key)
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_object_key)
+        except self.s3_client.exceptions.NoSuchKey:
+            return iter(())
+        return self._iter_stream(response['Body'], prefix)
+
+
+    @staticmethod
+    def _iter_stream(body, prefix: str):
+        """
+        Yields the items of a streamed S3 body, closing the body once iteration finishes or is abandoned
+        so its HTTP connection goes back to the pool.
+
+        :param body: The StreamingBody of a get_object response.
+        :param prefix: The ijson prefix of the items to yield.
+        :return: A generator of the items found under the prefix.
+        """
+        try:
+            yield from ijson.items(body, prefix)
+        finally:
+            body.close()
+
+
+    def _iter_pages(self, prefix: str, start_after: str = None):
+        """
+        Iterates over the pages of objects in the bucket with the given prefix.
+
+        :param prefix: The S3 prefix to list.
+        :param start_after: (Optional) The S3 object key after which to start listing.
+        :return: A generator of lists of object summaries returned by list_objects_v2.
+        """
+        kwargs = {'StartAfter': start_after} if start_after else {}
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=self.bucket_name, Prefix=prefix,
+                                   PaginationConfig={'PageSize': 1000}, **kwargs)
+        for page in pages:
+            yield page.get('Contents', [])
+
+
+    def _iter_objects(self, prefix: str, start_after: str = None):
+        """
+        Iterates over all objects in the bucket with the given prefix, following pagination.
+
+        :param prefix: The S3 prefix to list.
+        :param start_after: (Optional) The S3 object key after which to start listing.
+        :return: A generator of the object summaries returned by list_objects_v2.
+        """
+        for contents in self._iter_pages(prefix, start_after):
+            yield from contents
+
+
+    def list_keys(self, prefix: str = None, start_after: str = None):
         """
         Lists all the keys in the S3KV database.
 
-        :return: A list of all keys in the database.
+        :param prefix: (Optional) The prefix to filter the keys, with or without the S3KV key prefix.
+        :param start_after: (Optional) A key previously returned by a listing, after which to resume listing.
+        :return: A generator of all keys in the database.
         """
-        response = self.s3_client.list_objects_v2(Bucket=self.bucket_name, Prefix="")
-        keys = [obj['Key'][5:-5] for obj in response.get('Contents', []) if obj['Key'].endswith('.json')]
-        return keys
+        # Always list under the S3KV key prefix so S3 does not scan unrelated objects
+        if prefix is None:
+            prefix = self._prefix
+        elif not prefix.startswith(self._prefix):
+            prefix = self._prefix + prefix
+        if start_after is not None:
+            start_after = self._get_object_key(start_after)
+
+        # Skip objects not written by S3KV, such as folder markers like 's3kv/sub/'
+        pl, sl = len(self._prefix), len(self._suffix)
+        for contents in self._iter_pages(prefix, start_after):
+            yield from [k[pl:-sl] for k in map(_get_key, contents) if k.endswith(self._suffix)]
 
 
     def clear_cache(self):
         """
-        Clears the local cache by removing all cached JSON files.
+        Clears the local cache by removing all in-memory and on-disk entries.
         """
-        cache_directory = '/tmp/s3kv_cache'
-        if os.path.exists(cache_directory):
-            shutil.rmtree(cache_directory)
-        os.makedirs('/tmp/s3kv_cache')
+        with self._lru_lock:
+            self._lru.clear()
+            self._lru_bytes = 0
+            with self._db_lock:
+                self._db.execute('DELETE FROM kv')
 
 
     def clear_old_cache(self, max_days: int = 7):
@@ -141,16 +608,10 @@ class S3KV:
 
         :param max_days: The maximum number of days a key can stay in the cache before being cleared.
         """
-        cache_directory = '/tmp/s3kv_cache'
-        current_time = time.time()
+        oldest = time.time() - max_days * _DAY_SECONDS
 
-        if os.path.exists(cache_directory):
-            for filename in os.listdir(cache_directory):
-                file_path = os.path.join(cache_directory, filename)
-                if os.path.isfile(file_path):
-                    file_age = current_time - os.path.getmtime(file_path)
-                    if file_age > max_days * 86400:  # Convert days to seconds
-                        os.remove(file_path)
+        with self._db_lock:
+            self._db.execute('DELETE FROM kv WHERE ts < ?', (oldest,))
 
 
     def clear_cache_for_key(self, key: str):
@@ -159,9 +620,7 @@ class S3KV:
 
         :param key: The key for which to clear the local cache.
         """
-        cache_path = f'/tmp/s3kv_cache/{key}.json'
-        if os.path.exists(cache_path):
-            os.remove(cache_path)
+        self._cache_pop(key)
 
 
     def key_exists(self, key: str) -> bool:
@@ -170,26 +629,32 @@ class S3KV:
 
         :param key: The key to check.
         :return: True if the key exists, False otherwise.
+        :raises ClientError: If S3 fails for any reason other than the key not existing.
         """
+        # Keys cached in memory are known to exist
+        with self._lru_lock:
+            if key in self._lru:
+                return True
+
         s3_object_key = self._get_object_key(key)
         try:
             self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_object_key)
             return True
-        except Exception as e:
-                # Return false even if response is unauthorized or similar
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
                 return False
+            raise
 
 
-    def list_keys_with_prefix(self, prefix: str) -> list:
+    def list_keys_with_prefix(self, prefix: str, start_after: str = None):
         """
         Lists all the keys in the S3KV database that have a specific prefix.
 
-        :param prefix: The prefix to filter the keys.
-        :return: A list of keys in the database that have the specified prefix.
+        :param prefix: The prefix to filter the keys, with or without the S3KV key prefix.
+        :param start_after: (Optional) A key previously returned by a listing, after which to resume listing.
+        :return: A generator of keys in the database that have the specified prefix.
         """
-        response = self.s3_client.list_objects_v2(Bucket=self.bucket_name, Prefix=prefix)
-        keys = [obj['Key'][5:-5] for obj in response.get('Contents', []) if obj['Key'].endswith('.json')]
-        return keys
+        return self.list_keys(prefix, start_after)
 
 
     def copy_key(self, source_key: str, destination_key: str):
@@ -202,16 +667,27 @@ class S3KV:
         source_s3_object_key = self._get_object_key(source_key)
         destination_s3_object_key = self._get_object_key(destination_key)
 
-        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=source_s3_object_key)
-        value = response['Body'].read()
-
-        self.s3_client.put_object(Bucket=self.bucket_name, Key=destination_s3_object_key, Body=value)
+        # Server-side copy, the value is never transferred to the client
+        self.s3_client.copy_object(
+            Bucket=self.bucket_name,
+            Key=destination_s3_object_key,
+            CopySource={'Bucket': self.bucket_name, 'Key': source_s3_object_key}
+        )
+        self._forget_missing(destination_key)
 
         # Copy the key in the local cache if it exists
-        source_cache_path = f'/tmp/s3kv_cache/{source_key}.json'
-        destination_cache_path = f'/tmp/s3kv_cache/{destination_key}.json'
-        if os.path.exists(source_cache_path):
-            shutil.copy(source_cache_path, destination_cache_path)
+        with self._lru_lock:
+            entry = self._lru.get(source_key)
+            if entry is not None:
+                self._cache_put_locked(destination_key, entry[0], None, True)
+            else:
+                # Drop the destination's old value, then copy the source's on-disk row if any
+                if destination_key in self._lru:
+                    self._lru_bytes -= len(self._lru.pop(destination_key)[0])
+                with self._db_lock, _transaction(self._db):
+                    self._db.execute('DELETE FROM kv WHERE key = ?', (destination_key,))
+                    self._db.execute('INSERT INTO kv (key, value, ts) SELECT ?, value, ts FROM kv WHERE key = ?',
+                                     (destination_key, source_key))
 
 
     def get_key_size(self, key: str) -> int:
@@ -239,10 +715,7 @@ class S3KV:
         s3_object_key = self._get_object_key(key)
         try:
             response = self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_object_key)
-            last_modified = response['LastModified']
-            st = time.mktime(last_modified.timetuple())
-
-            return  datetime.fromtimestamp(st)
+            return response['LastModified'].timestamp()
 
         except self.s3_client.exceptions.NoSuchKey:
             return 0
@@ -270,7 +743,7 @@ class S3KV:
             ]
         }
 
-        policy_json = json.dumps(policy)
+        policy_json = _dumps(policy).decode('utf-8')
         self.s3_client.put_bucket_policy(Bucket=self.bucket_name, Policy=policy_json)
 
 
@@ -301,8 +774,9 @@ class S3KV:
         """
         keys_to_tag = self.list_keys_with_prefix(prefix)
 
-        for key in keys_to_tag:
-            self.tag_key(key, tags)
+        futures = [self._executor.submit(self.tag_key, key, tags) for key in keys_to_tag]
+        for future in as_completed(futures):
+            future.result()
 
 
     def merge_keys(self, source_keys: list, destination_key: str):
@@ -317,41 +791,71 @@ class S3KV:
         # Initialize an empty dictionary for the destination value
         destination_value = {}
 
-        # Retrieve and merge values from source keys
-        for source_key in source_keys:
-            source_value = self.get(source_key)
+        # Retrieve the values of the source keys concurrently and merge them in order
+        for source_value in self._executor.map(self.get, source_keys):
             if source_value:
                 destination_value.update(source_value)
 
         # Update the destination value in the S3 bucket
-        serialized_value = json.dumps(destination_value)
+        serialized_value = _dumps(destination_value)
         self.s3_client.put_object(Bucket=self.bucket_name, Key=destination_s3_object_key, Body=serialized_value)
 
-        # Update the value in the local cache if it exists
-        destination_cache_path = f'/tmp/s3kv_cache/{destination_key}.json'
-        with open(destination_cache_path, 'w') as f:
-            json.dump(destination_value, f)
+        # Update the value in the local cache
+        self._forget_missing(destination_key)
+        self._cache_put(destination_key, serialized_value)
 
 
 
-    def find_keys_by_tag_value(self, tag_key: str, tag_value: str) -> list:
+    def find_keys_by_tag_value(self, tag_key: str, tag_value: str):
         """
         Finds keys in the S3KV database based on the value of a specific tag.
 
         :param tag_key: The tag key to search for.
         :param tag_value: The tag value to search for.
-        :return: A list of keys that have the specified tag key with the specified value.
-        """
-        response = self.s3_client.list_objects_v2(Bucket=self.bucket_name, Prefix="s3kv/")
-        keys_with_tag = []
+        :return: A generator of keys that have the specified tag key with the specified value.
+        """
+        pl, sl = len(self._prefix), len(self._suffix)
+        for contents in self._iter_pages(self._prefix):
+            # Fetch the tags of a whole page concurrently, yielding keys in listing order
+            futures = [(k, self._executor.submit(self.get_tags, k))
+                       for k in map(_get_key, contents) if k.endswith(self._suffix)]
+            try:
+                for s3_object_key, future in futures:
+                    tags = future.result()
+                    if tags and tag_key in tags and tags[tag_key] == tag_value:
+                        yield s3_object_key[pl:-sl]  # Extract the key name
+            finally:
+                # Don't leave requests queued on the shared pool if the caller stops early
+                for _, future in futures:
+                    future.cancel()
+
+    async def find_keys_by_tag_value_async(self, tag_key: str, tag_value: str):
+        """
+        Finds keys in the S3KV database based on the value of a specific tag using asyncio.
+        Requires the aioboto3 package.
 
-        for obj in response.get('Contents', []):
-            s3_object_key = obj['Key']
-            tags = self.get_tags(s3_object_key)
-            if tags and tag_key in tags and tags[tag_key] == tag_value:
-                keys_with_tag.append(s3_object_key[5:-5])  # Extract the key name
-
-        return keys_with_tag
+        :param tag_key: The tag key to search for.
+        :param tag_value: The tag value to search for.
+        :return: An async generator of keys that have the specified tag key with the specified value.
+        """
+        semaphore = asyncio.Semaphore(_MAX_ASYNC_CONCURRENCY)
+        pl, sl = len(self._prefix), len(self._suffix)
+
+        async with self._async_client() as client:
+            async def get_tags(s3_object_key: str) -> dict:
+                async with semaphore:
+                    response = await client.get_object_tagging(Bucket=self.bucket_name, Key=s3_object_key)
+                return {tag['Key']: tag['Value'] for tag in response.get('TagSet', [])}
+
+            paginator = client.get_paginator('list_objects_v2')
+            async for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self._prefix,
+                                                 PaginationConfig={'PageSize': 1000}):
+                s3_object_keys = [k for k in map(_get_key, page.get('Contents', [])) if k.endswith(self._suffix)]
+                # Fetch the tags of a whole page concurrently
+                tag_sets = await asyncio.gather(*(get_tags(k) for k in s3_object_keys))
+                for s3_object_key, tags in zip(s3_object_keys, tag_sets):
+                    if tags.get(tag_key) == tag_value:
+                        yield s3_object_key[pl:-sl]  # Extract the key name
 
     def get_tags(self, s3_object_key: str) -> dict:
         """
@@ -378,7 +882,7 @@ class S3KV:
         s3_object_key = self._get_object_key(key)
         print(s3_object_key)
 
-        retention_period = retention_days * 24 * 60 * 60  # Convert days to seconds
+        retention_period = retention_days * _DAY_SECONDS
 
         self.s3_client.put_object_retention(
             Bucket=self.bucket_name,
@@ -398,13 +902,22 @@ class S3KV:
         """
         s3_object_key = self._get_object_key(key)
 
+        # Skip the removal if the key is not locked
+        try:
+            response = self.s3_client.get_object_retention(Bucket=self.bucket_name, Key=s3_object_key)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchObjectLockConfiguration':
+                return
+            raise
+        if not response.get('Retention'):
+            return
+
+        # An empty retention clears the lock
         self.s3_client.put_object_retention(
             Bucket=self.bucket_name,
             Key=s3_object_key,
             BypassGovernanceRetention=True,
-            Retention={
-                
-            }
+            Retention={}
         )
 
 
@@ -414,11 +927,37 @@ class S3KV:
 
         :param tag_key: The tag key to match for deletion.
         :param tag_value: The tag value to match for deletion.
-        """
-        keys_to_delete = self.find_keys_by_tag_value(tag_key, tag_value)
-
-        for key in keys_to_delete:
-            self.delete(key)
+        :raises ClientError: If any of the keys could not be deleted, after all batches have been attempted.
+        """
+        # Collect the keys first so the listing is not affected by the deletes
+        keys_to_delete = list(self.find_keys_by_tag_value(tag_key, tag_value))
+
+        errors = []
+        for i in range(0, len(keys_to_delete), _DELETE_BATCH_SIZE):
+            batch = keys_to_delete[i:i + _DELETE_BATCH_SIZE]
+            response = self.s3_client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={
+                    'Objects': [{'Key': self._get_object_key(key)} for key in batch],
+                    'Quiet': True
+                }
+            )
+
+            # Quiet mode only reports the keys that could not be deleted
+            errors.extend(response.get('Errors', []))
+            failed = {error['Key'] for error in response.get('Errors', [])}
+            for key in batch:
+                if self._get_object_key(key) not in failed:
+                    self._forget_missing(key)
+                    self._cache_pop(key)
+
+        if errors:
+            message = ', '.join(f"{error['Key']}: {error.get('Code')}" for error in errors)
+            raise ClientError(
+                {'Error': {'Code': errors[0].get('Code'), 'Message': f"Failed to delete {message}"},
+                 'Errors': errors},
+                'DeleteObjects'
+            )
 
 
     def apply_legal_hold(self, key: str):
@@ -17,6 +17,11 @@ setup(
     install_requires=[
         'boto3', 'elasticsearch'
     ],
+    extras_require={
+        'fast': ['orjson'],
+        'stream': ['ijson'],
+        'async': ['aioboto3']
+    },
     classifiers=[
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python',
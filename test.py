@@ -11,7 +11,7 @@ s3kv = S3KV(os.environ['S3_ENDPOINT_URL'],
 
 s3kv.add('key1', 'value1')
 
-keys = s3kv.list_keys()
+keys = list(s3kv.list_keys())
 print(keys)
 
 data = {"test":"test"}
@@ -21,7 +21,7 @@ for key in ['test.streamzero.01', 'test.streamzero.02', 'test.streamzero.03', 't
     s3kv.add(key,data,None)
 '''
 
-keys = s3kv.list_keys()
+keys = list(s3kv.list_keys())
 print(keys)
 
 
@@ -59,7 +59,7 @@ print(s3kv.get('test_c'))
 s3kv.tag_key('test_c',  tags={'module': 'user_management', 'environment': 'production'})
 
 
-keys = s3kv.find_keys_by_tag_value('environment','production')
+keys = list(s3kv.find_keys_by_tag_value('environment','production'))
 print(f"keys with tag environment:production - {keys}")
 
 tags = s3kv.get_tags('s3kv/test_c.json')
@@ -0,0 +1,187 @@
+from io import BytesIO
+
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from botocore.stub import ANY, Stubber
+
+import s3kv.s3kv as s3kv_module
+from s3kv.s3kv import S3KV
+
+
+@pytest.fixture
+def make_kv(tmp_path, monkeypatch):
+    """
+    Builds S3KV instances backed by a stubbed S3 client and a temporary SQLite cache.
+    """
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setattr(s3kv_module, '_CACHE_DB_PATH', str(tmp_path / 's3kv_cache.sqlite'))
+    monkeypatch.setattr(s3kv_module, '_cache_db', None)
+    s3kv_module._negative_cache.clear()
+    stubbers = []
+
+    def make(**kwargs):
+        kv = S3KV('http://localhost:9000', 'bucket', 'key', 'secret', **kwargs)
+        kv.s3_client = boto3.client('s3', region_name='us-east-1',
+                                    aws_access_key_id='key', aws_secret_access_key='secret')
+        stubber = Stubber(kv.s3_client)
+        stubber.activate()
+        stubbers.append(stubber)
+        return kv, stubber
+
+    yield make
+
+    for stubber in stubbers:
+        stubber.deactivate()
+    if s3kv_module._cache_db is not None:
+        s3kv_module._cache_db.close()
+    s3kv_module._negative_cache.clear()
+
+
+def stub_put(stubber, key):
+    stubber.add_response('put_object', {}, {'Bucket': 'bucket', 'Key': f's3kv/{key}.json', 'Body': ANY})
+
+
+def body(data: bytes):
+    return StreamingBody(BytesIO(data), len(data))
+
+
+def disk_keys(kv):
+    return sorted(row[0] for row in kv._db.execute('SELECT key FROM kv'))
+
+
+def test_evicts_by_entry_count(make_kv):
+    kv, stubber = make_kv(cache_max_entries=2)
+    for key in ('a', 'b', 'c'):
+        stub_put(stubber, key)
+        kv.add(key, {'key': key})
+
+    assert list(kv._lru) == ['b', 'c']
+    assert disk_keys(kv) == ['a']
+
+
+def test_evicts_by_bytes(make_kv):
+    kv, stubber = make_kv(cache_max_bytes=30)
+    for key in ('a', 'b', 'c'):
+        stub_put(stubber, key)
+        kv.add(key, {'value': 'x' * 5})  # 17 bytes each
+
+    assert list(kv._lru) == ['c']
+    assert kv._lru_bytes == 17
+    assert disk_keys(kv) == ['a', 'b']
+
+
+def test_promotes_spilled_entry_and_keeps_row(make_kv):
+    kv, stubber = make_kv(cache_max_entries=1)
+    stub_put(stubber, 'a')
+    kv.add('a', {'v': 1})
+    stub_put(stubber, 'b')
+    kv.add('b', {'v': 2})
+
+    assert kv.get_from_cache('a') == {'v': 1}
+    assert list(kv._lru) == ['a']
+    # The promoted row stays on disk for other instances, b was spilled in turn
+    assert disk_keys(kv) == ['a', 'b']
+
+
+def test_cached_value_is_a_snapshot(make_kv):
+    kv, stubber = make_kv()
+    value = {'v': 1}
+    stub_put(stubber, 'a')
+    kv.add('a', value)
+    value['v'] = 2
+    kv.get_from_cache('a')['v'] = 3
+
+    assert kv.get_from_cache('a') == {'v': 1}
+
+
+def test_add_invalidates_spilled_row(make_kv):
+    a, stubber = make_kv(cache_max_entries=1)
+    b, _ = make_kv()
+    stub_put(stubber, 'k')
+    a.add('k', {'v': 1})
+    stub_put(stubber, 'other')
+    a.add('other', {'v': 0})
+    stub_put(stubber, 'k')
+    a.add('k', {'v': 2})
+
+    assert b.get_from_cache('k') is None
+
+
+def test_delete_invalidates_spilled_row(make_kv):
+    kv, stubber = make_kv(cache_max_entries=1)
+    stub_put(stubber, 'k')
+    kv.add('k', {'v': 1})
+    stub_put(stubber, 'other')
+    kv.add('other', {'v': 0})
+    stubber.add_response('delete_object', {}, {'Bucket': 'bucket', 'Key': 's3kv/k.json'})
+    kv.delete('k')
+
+    assert disk_keys(kv) == []
+    assert kv.get_from_cache('k') is None
+
+
+def test_negative_cache_skips_repeated_misses(make_kv):
+    kv, stubber = make_kv()
+    stubber.add_client_error('get_object', service_error_code='NoSuchKey', http_status_code=404)
+
+    assert kv.get('missing', 'default') == 'default'
+    # No response is stubbed, a second request would fail
+    assert kv.get('missing', 'default') == 'default'
+    stubber.assert_no_pending_responses()
+
+
+def test_negative_cache_expires(make_kv, monkeypatch):
+    kv, stubber = make_kv()
+    monkeypatch.setattr(s3kv_module, '_NEGATIVE_CACHE_TTL', 0)
+    stubber.add_client_error('get_object', service_error_code='NoSuchKey', http_status_code=404)
+    stubber.add_client_error('get_object', service_error_code='NoSuchKey', http_status_code=404)
+
+    assert kv.get('missing') is None
+    assert kv.get('missing') is None
+    stubber.assert_no_pending_responses()
+
+
+def test_negative_cache_invalidated_by_other_instance(make_kv):
+    a, stubber_a = make_kv()
+    b, stubber_b = make_kv()
+    stubber_a.add_client_error('get_object', service_error_code='NoSuchKey', http_status_code=404)
+    assert a.get('k') is None
+
+    stub_put(stubber_b, 'k')
+    b.add('k', {'v': 1})
+
+    stubber_a.add_response('get_object', {'Body': body(b'{"v":1}')},
+                           {'Bucket': 'bucket', 'Key': 's3kv/k.json'})
+    assert a.get('k') == {'v': 1}
+
+
+def test_delete_by_tag_raises_on_partial_failure(make_kv):
+    kv, stubber = make_kv()
+    for key in ('a', 'b'):
+        stub_put(stubber, key)
+        kv.add(key, {'key': key})
+
+    stubber.add_response('list_objects_v2', {
+        'Contents': [{'Key': 's3kv/a.json'}, {'Key': 's3kv/b.json'}],
+        'IsTruncated': False
+    })
+    # Tags are fetched concurrently, so the requests may arrive in any order
+    for _ in range(2):
+        stubber.add_response('get_object_tagging', {'TagSet': [{'Key': 'env', 'Value': 'dev'}]})
+    stubber.add_response('delete_objects', {
+        'Errors': [{'Key': 's3kv/b.json', 'Code': 'AccessDenied', 'Message': 'Access Denied'}]
+    }, {
+        'Bucket': 'bucket',
+        'Delete': {'Objects': [{'Key': 's3kv/a.json'}, {'Key': 's3kv/b.json'}], 'Quiet': True}
+    })
+
+    with pytest.raises(ClientError) as excinfo:
+        kv.delete_by_tag('env', 'dev')
+
+    assert excinfo.value.response['Error']['Code'] == 'AccessDenied'
+    assert [error['Key'] for error in excinfo.value.response['Errors']] == ['s3kv/b.json']
+    assert list(kv._lru) == ['b']